@@ -6,15 +6,98 @@
 
 """
 
+import os
+import re
+import json
 import requests
-from bs4 import BeautifulSoup
+from lxml import etree
 import pandas as pd
-import numpy as np
 import smtplib
 from email.mime.text import MIMEText
-import imaplib
+import aioimaplib
+import asyncio
 import email
+import datetime
+import functools
+from typing import Optional
 from email.header import decode_header
+from email.utils import parsedate_to_datetime
+
+# journal name in a journal or article URL (e.g. /journal-of-glaciology/)
+_JOURNAL_RE = re.compile(r"/([a-z0-9-]*-of-[a-z0-9-]*)(?:/|$)")
+
+# keep "of" lowercase once journal name is capitalized
+_OF_RE = re.compile(r"\bOf\b")
+
+
+def _check_imap_response(response: aioimaplib.Response, command: str) -> None:
+    """
+    Raise if an IMAP4 command did not succeed. Unlike imaplib, aioimaplib
+    returns NO and BAD replies instead of raising.
+
+    :param response: Response to an IMAP4 command
+    :param command: Name of the IMAP4 command
+
+    :returns: None
+    """
+
+    if response.result != "OK":
+        raise aioimaplib.Error(
+            f"IMAP4 {command} failed ({response.result}): {response.lines}"
+        )
+
+    return None
+
+
+def _write_json(path: str, obj: dict) -> None:
+    """
+    Write an object to a JSON file, through a temporary file so that an
+    interrupted run never leaves a truncated file.
+
+    :param path: Path to JSON file
+    :param obj: Object to write
+
+    :returns: None
+    """
+
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp_file, path)
+
+    return None
+
+
+def _parse_email(raw_email: bytes) -> tuple:
+    """
+    Parse the fields of a raw email needed to identify FirstView alerts.
+
+    :param raw_email: Raw email as returned by an IMAP4 FETCH
+
+    :returns message_subject: Decoded subject, None if email has no subject
+    :returns message_date: Sending date, None if missing or invalid
+    :returns payload: Raw (transfer-decoded) email body
+    """
+
+    # parse a bytes email into a message object
+    msg = email.message_from_bytes(raw_email)
+
+    # decode email subject
+    raw_subject = msg["Subject"]
+    message_subject = None
+    if raw_subject is not None:
+        message_subject, encoding = decode_header(raw_subject)[0]
+
+    # decode email date
+    try:
+        message_date = parsedate_to_datetime(msg.get("Date"))
+    except (TypeError, ValueError):
+        message_date = None
+
+    # get raw email body
+    payload = msg.get_payload(decode=True) or b""
+
+    return message_subject, message_date, payload
 
 
 class EmailAlert:
@@ -36,18 +119,138 @@ class EmailAlert:
         self.sender_user = sender_user
         self.sender_authfile = sender_authfile
 
-    def login_smtp(self, user: str, auth_file: str) -> smtplib.SMTP:
+        # password is read from sender_authfile on first login only
+        self._password = None
+
+        # IMAP4 and SMTP sessions are opened on first use and reused
+        self._imap = None
+        self._smtp = None
+
+        # sessions are shared between journals checked concurrently
+        self._imap_lock = asyncio.Lock()
+        self._smtp_lock = asyncio.Lock()
+
+        # HTTP session keeping connections to journal websites alive
+        self._http = requests.Session()
+        self._http.headers.update(
+            {"User-Agent": "IGS-email-alert", "Accept-Encoding": "gzip"}
+        )
+
+        # HTTP validators and last checked article of each journal, kept
+        # next to the authentification file between runs
+        self._http_cache_file = os.path.join(
+            os.path.dirname(os.path.abspath(sender_authfile)), "FirstView_cache.json"
+        )
+        self._http_cache = self._load_http_cache()
+
+        # FirstView articles already alerted on, by day, kept between runs;
+        # None if no record exists yet (IMAP4 inbox is then checked instead)
+        self._alerted_file = os.path.expanduser("~/.igs_alerts.json")
+        self._alerted = self._load_alerted()
+
+    def _load_http_cache(self) -> dict:
+        """
+        Load HTTP cache of previous runs.
+
+        :returns http_cache: Cached HTTP validators and last checked article
+                             for each journal URL
+        """
+
+        try:
+            with open(self._http_cache_file) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _update_http_cache(self, journal_url: str, **fields) -> None:
+        """
+        Update HTTP cache entry of a given journal and write cache to disk.
+
+        :param journal_url: Journal url
+        :param fields: Entry fields to update (etag, last_modified,
+                       last_seen_article)
+
+        :returns: None
         """
-        Login on an SMTP server that requires authentification.
 
-        :param user: User email address
-        :param auth_file: Path to authentification file
+        self._http_cache.setdefault(journal_url, {}).update(fields)
+
+        _write_json(self._http_cache_file, self._http_cache)
+
+        return None
+
+    def _load_alerted(self) -> Optional[dict]:
+        """
+        Load record of alerts sent during previous runs.
+
+        :returns alerted: Set of alerted article URLs for each day
+                          (YYYY-MM-DD), None if no record exists
+        """
+
+        try:
+            with open(self._alerted_file) as f:
+                alerted = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        # valid JSON that is not a record is treated as a corrupted record
+        if not isinstance(alerted, dict):
+            return None
+
+        return {day: set(urls) for day, urls in alerted.items()}
+
+    def _record_alert(self, day: str, article_url: str) -> None:
+        """
+        Record an alerted article and write record to disk.
+
+        :param day: Day of the alert (YYYY-MM-DD)
+        :param article_url: URL of the alerted article
+
+        :returns: None
+        """
+
+        # only alerts of the current day are needed
+        urls = set() if self._alerted is None else self._alerted.get(day, set())
+        urls.add(article_url)
+        self._alerted = {day: urls}
+
+        _write_json(
+            self._alerted_file, {d: sorted(u) for d, u in self._alerted.items()}
+        )
+
+        return None
+
+    def _get_password(self) -> str:
+        """
+        Read sender password from authentification file, once per instance.
+
+        :returns password: Sender password
+        """
+
+        if self._password is None:
+            with open(self.sender_authfile) as f:
+                self._password = f.read().strip()
+
+        return self._password
+
+    def _ensure_smtp(self) -> smtplib.SMTP:
+        """
+        Return an open SMTP session, logging in on the SMTP server
+        (which requires authentification) if no live session is cached.
 
         :returns smtp_session: Open SMTP session
         """
 
+        # reuse cached session if the server still answers
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+
         # extract password from authentication file
-        password = str(np.genfromtxt(auth_file, dtype="str"))
+        password = self._get_password()
 
         # create a SMTP instance
         smtp_session = smtplib.SMTP("smtp.live.com", 587)
@@ -60,32 +263,76 @@ class EmailAlert:
         smtp_session.ehlo()
 
         # login on the SMTP server
-        smtp_session.login(user, password)
+        smtp_session.login(self.sender_user, password)
+
+        self._smtp = smtp_session
 
         return smtp_session
 
-    def login_imap(self, user: str, auth_file: str) -> imaplib.IMAP4_SSL:
+    async def _connect_imap(self) -> aioimaplib.IMAP4_SSL:
         """
-        Login on an IMAP4 server that requires authentification.
+        Return an open IMAP4 session, logging in on the IMAP4 server
+        (which requires authentification) if no live session is cached.
 
-        :param user: User email address
-        :param auth_file: Path to authentification file
-
-        :returns smtp_session: Open IMAP4 session
+        :returns imap_session: Open IMAP4 session
         """
 
+        # reuse cached session if the server still answers
+        if self._imap is not None:
+            try:
+                if (await self._imap.noop()).result == "OK":
+                    return self._imap
+            except (aioimaplib.Error, asyncio.TimeoutError, OSError):
+                pass
+
         # extract password from authentication file
-        password = str(np.genfromtxt(auth_file, dtype="str"))
+        password = self._get_password()
 
         # create an IMAP instance over an SSL encrypted socket
-        imap_session = imaplib.IMAP4_SSL("smtp.live.com")
+        imap_session = aioimaplib.IMAP4_SSL("smtp.live.com")
+        await imap_session.wait_hello_from_server()
 
-        # login on the IMAP4 server
-        imap_session.login(user, password)
+        # login on the IMAP4 server, only caching authenticated sessions
+        response = await imap_session.login(self.sender_user, password)
+        if response.result != "OK":
+            try:
+                await imap_session.logout()
+            except (aioimaplib.Error, asyncio.TimeoutError, OSError):
+                pass
+        _check_imap_response(response, "LOGIN")
+
+        self._imap = imap_session
 
         return imap_session
 
-    def journal_url_to_plaintext(self, journal_url: str) -> str:
+    async def close(self) -> None:
+        """
+        Terminate cached IMAP4, SMTP and HTTP sessions and close connections.
+
+        :returns: None
+        """
+
+        if self._imap is not None:
+            try:
+                await self._imap.logout()
+            except (aioimaplib.Error, asyncio.TimeoutError, OSError):
+                pass
+            self._imap = None
+
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+        self._http.close()
+
+        return None
+
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def journal_url_to_plaintext(journal_url: str) -> str:
         """
         Convert journal URL string to plain text.
 
@@ -95,21 +342,14 @@ class EmailAlert:
         """
 
         # extract journal name
-        journal_name = [
-            string for string in journal_url.split("/") if "-of-" in string
-        ][0]
-
-        # extract words in journal name
-        journal_words = journal_name.split("-")
+        journal_name = _JOURNAL_RE.search(journal_url).group(1)
 
         # convert to plain text and capitalize words that are needed
-        ptxt_journal_name = " ".join(
-            [word.capitalize() if word != "of" else word for word in journal_words]
-        )
+        ptxt_journal_name = _OF_RE.sub("of", journal_name.replace("-", " ").title())
 
         return ptxt_journal_name
 
-    def check_emails(self, new_FirstView_url: str) -> bool:
+    async def check_emails(self, new_FirstView_url: str) -> bool:
         """
         Check if user already received an email alert for a given
         FirstView article.
@@ -128,61 +368,157 @@ class EmailAlert:
         # assume email alert has not been sent yet
         alert_sent = False
 
-        # setup IMAP4 connection
-        imap = self.login_imap(self.sender_user, self.sender_authfile)
+        # today's date, computed once for all candidate emails
+        today = datetime.date.today()
+
+        # get (cached) IMAP4 connection
+        imap = await self._connect_imap()
 
         # check email inbox
-        status, messages = imap.select("INBOX")
+        response = await imap.select("INBOX")
+        _check_imap_response(response, "SELECT")
+
+        # let the server look for FirstView alerts received today
+        response = await imap.search(
+            "SUBJECT",
+            f'"{new_FirstView_subject}"',
+            "SINCE",
+            today.strftime("%d-%b-%Y"),
+            charset=None,
+        )
+        _check_imap_response(response, "SEARCH")
+        ids = response.lines[0].split()
 
-        # select top 100 emails (if user gets more than 100 emails per day,
-        # they should do something about it)
-        N = 100
+        # no candidate alert in inbox
+        if not ids:
+            return alert_sent
 
-        # total number of emails in inbox
-        messages = int(messages[0])
+        # fetch candidate emails in a single command
+        seq = ",".join(i.decode() for i in ids)
+        response = await imap.fetch(seq, "(BODY.PEEK[])")
+        _check_imap_response(response, "FETCH")
 
-        for i in range(messages, messages - N, -1):
+        # emails are returned as literals, other lines are FETCH
+        # status lines and closing parentheses
+        raw_emails = [
+            bytes(line) for line in response.lines if isinstance(line, bytearray)
+        ]
 
-            # fetch the email message by ID
-            res, msg = imap.fetch(str(i), "(RFC822)")
+        # parse emails inline: SEARCH leaves only today's alerts for this
+        # journal (usually none or one), far too few to pay for worker
+        # processes
+        parsed_emails = [_parse_email(raw_email) for raw_email in raw_emails]
 
-            for response in msg:
+        for message_subject, message_date, payload in parsed_emails:
 
-                if isinstance(response, tuple):
+            # skip emails without subject
+            if message_subject is None:
+                print("Email could not be decoded")
+                continue
 
-                    # parse a bytes email into a message object
-                    msg = email.message_from_bytes(response[1])
+            # SEARCH matches subjects case-insensitively on substrings,
+            # so select the exact FirstView alert email
+            if message_subject == new_FirstView_subject:
 
-                    try:
+                # only consider alerts sent today
+                if message_date is None or message_date.date() != today:
+                    continue
 
-                        # decode email subject
-                        message_subject, encoding = decode_header(msg["Subject"])[0]
-                    except TypeError:
+                # check if this is the targeted alert (on raw bytes, the
+                # ASCII URL does not require decoding the email body)
+                if new_FirstView_url.encode() in payload:
 
-                        print("Email could not be decoded")
-                        continue
+                    alert_sent = True
 
-                    # select FirstView alert email
-                    if message_subject == new_FirstView_subject:
+        return alert_sent
 
-                        # decode email date
-                        message_date = pd.to_datetime(msg.get("Date"))
+    def _send_alert(self, journal_name: str, article_url: str) -> None:
+        """
+        Send an email alert for a new FirstView article. The SMTP session
+        is left open for other alerts and only terminated in close().
 
-                        # get email body
-                        body = msg.get_payload(decode=True).decode()
+        :param journal_name: Journal name in plain text
+        :param article_url: URL of the new FirstView article
 
-                        # check if this is the targeted alert
-                        if (
-                            message_date.strftime("%Y-%m-%d")
-                            == pd.to_datetime("today").strftime("%Y-%m-%d")
-                            and new_FirstView_url in body
-                        ):
+        :returns: None
+        """
 
-                            alert_sent = True
+        # write a generic body text for email alert
+        body_text = (
+            "An automated python script detected a"
+            + f" new FirstView article in {journal_name}:\n"
+            + f"{article_url}\n\n"
+        )
 
-        return alert_sent
+        # build email through a MIME object
+        message = MIMEText(body_text, "plain", "utf-8")
+        message["From"] = self.sender_user
+        message["To"] = self.sender_user
+        message["Subject"] = f"New FirstView article in {journal_name}!"
 
-    def check_new_FirstViews(self, journal_url: str) -> None:
+        # send email
+        self._ensure_smtp().sendmail(
+            self.sender_user, self.sender_user, message.as_string(),
+        )
+
+        return None
+
+    def _find_last_publication(self, r: requests.Response) -> tuple:
+        """
+        Stream a journal webpage through an incremental parser and stop
+        downloading as soon as the last publication has been found.
+
+        :param r: Streamed response of a GET request to a journal url
+
+        :returns date_text: Publication date of last article, None if not found
+        :returns href: Relative link to last article, None if not found
+        """
+
+        parser = etree.HTMLPullParser(events=("start", "end"))
+
+        date_text = None
+        href = None
+
+        try:
+            for chunk in r.iter_content(chunk_size=8192):
+
+                parser.feed(chunk)
+
+                for event, element in parser.read_events():
+
+                    classes = (element.get("class") or "").split()
+
+                    # href is available as soon as <a class="part-link"> opens
+                    if (
+                        href is None
+                        and event == "start"
+                        and element.tag == "a"
+                        and "part-link" in classes
+                    ):
+                        href = element.get("href")
+
+                    # date text is complete once its <span class="date"> closes
+                    elif (
+                        date_text is None
+                        and event == "end"
+                        and element.tag == "span"
+                        and "date" in classes
+                        and any(
+                            "published" in (li.get("class") or "").split()
+                            for li in element.iterancestors("li")
+                        )
+                    ):
+                        date_text = "".join(element.itertext())
+
+                # both targets found, skip the rest of the webpage
+                if date_text is not None and href is not None:
+                    break
+        finally:
+            r.close()
+
+        return date_text, href
+
+    async def check_new_FirstViews(self, journal_url: str) -> None:
         """
         Check journal website for the publication of new FirstView articles.
 
@@ -194,82 +530,133 @@ class EmailAlert:
         # convert journal URL to a plain text journal name
         journal_name = self.journal_url_to_plaintext(journal_url)
 
-        # make a GET request to journal_url
-        r = requests.get(journal_url)
+        # make a conditional GET request to journal_url, based on the
+        # validators of the previous run
+        cached = self._http_cache.get(journal_url, {})
+        headers = {}
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+        r = await asyncio.to_thread(
+            self._http.get, journal_url, headers=headers, stream=True, timeout=10
+        )
 
-        # extract content
-        c = r.content
+        # webpage has not changed since previous run
+        if r.status_code == 304:
+            r.close()
+            return None
 
-        # make a soup (parse webpage)
-        soup = BeautifulSoup(c, features="html.parser")
+        # validators are only stored once the webpage has been processed
+        validators = {
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+        }
 
-        # find element corresponding to last publication on webpage
-        published_attr_li_tag = soup.find("li", attrs={"class": "published"})
+        # find date and link of last publication on webpage
+        date_attr_span_tag, partlink_href = await asyncio.to_thread(
+            self._find_last_publication, r
+        )
 
-        try:
-            date_attr_span_tag = published_attr_li_tag.find(
-                "span", attrs={"class": "date"}
-            ).text
-        except AttributeError:
+        if date_attr_span_tag is None or partlink_href is None:
             print(f"No publication tag could be found at {journal_url}")
             return None
 
-        partlink_attr_a_tag = soup.find("a", attrs={"class": "part-link"})
-
         # reconstruct article URL
-        article_url = "https://www.cambridge.org" + partlink_attr_a_tag.get("href")
+        article_url = "https://www.cambridge.org" + partlink_href
+
+        # last article has already been checked during a previous run
+        if article_url == cached.get("last_seen_article"):
+            self._update_http_cache(journal_url, **validators)
+            return None
 
         # extract publication date
         publication_date = pd.to_datetime(date_attr_span_tag)
+        today = datetime.date.today()
 
         # consider article only if published today
-        if publication_date.strftime("%Y-%m-%d") == pd.to_datetime("today").strftime(
-            "%Y-%m-%d"
-        ):
+        if publication_date.strftime("%Y-%m-%d") == today.isoformat():
 
-            # check if alert already has been sent for this new article
-            already_sent = self.check_emails(article_url)
+            # check if alert already has been sent for this new article,
+            # falling back on the IMAP4 inbox if no local record exists
+            if self._alerted is not None:
+                already_sent = article_url in self._alerted.get(
+                    today.isoformat(), ()
+                )
+            else:
+                async with self._imap_lock:
+                    already_sent = await self.check_emails(article_url)
+                if already_sent:
+                    self._record_alert(today.isoformat(), article_url)
 
             # send alert if not already sent
             if not already_sent:
 
-                # write a generic body text for email alert
-                body_text = (
-                    "An automated python script detected a"
-                    + f" new FirstView article in {journal_name}:\n"
-                    + f"{article_url}\n\n"
-                )
+                # send email through the (cached) SMTP connection
+                async with self._smtp_lock:
+                    await asyncio.to_thread(
+                        self._send_alert, journal_name, article_url
+                    )
 
-                # build email through a MIME object
-                message = MIMEText(body_text, "plain", "utf-8")
-                message["From"] = self.sender_user
-                message["To"] = self.sender_user
-                message["Subject"] = f"New FirstView article in {journal_name}!"
+                # keep track of alert locally
+                self._record_alert(today.isoformat(), article_url)
 
-                # setup SMTP connection
-                s = self.login_smtp(self.sender_user, self.sender_authfile)
-
-                # send email
-                s.sendmail(
-                    self.sender_user, self.sender_user, message.as_string(),
-                )
+            # alert has been sent, no need to check this article again
+            validators["last_seen_article"] = article_url
 
-                # terminate SMTP session and close connection
-                s.quit()
+        self._update_http_cache(journal_url, **validators)
 
         return None
 
 
+async def main(sender: EmailAlert, journal_urls: list) -> None:
+    """
+    Check journals concurrently for new FirstView articles, then terminate
+    sender sessions.
+
+    :param sender: Initialized sender account
+    :param journal_urls: Journal urls
+
+    :returns: None
+    """
+
+    # let every journal check run to completion, even if another one fails,
+    # so that sent alerts are always recorded
+    try:
+        results = await asyncio.gather(
+            *[sender.check_new_FirstViews(url) for url in journal_urls],
+            return_exceptions=True,
+        )
+    finally:
+        # terminate IMAP4, SMTP and HTTP sessions
+        await sender.close()
+
+    # report failed journal checks
+    failures = [
+        (url, result)
+        for url, result in zip(journal_urls, results)
+        if isinstance(result, BaseException)
+    ]
+    for url, error in failures:
+        print(f"Checking {url} failed: {error!r}")
+
+    if failures:
+        raise failures[0][1]
+
+    return None
+
+
 if __name__ == "__main__":
 
     # create an instance of EmailAlert, initialize sender account
     sender = EmailAlert("sender@example.com", "/path/to/auth.txt")
 
+    # journals to check for new FirstView articles
+    urls = [
+        "https://www.cambridge.org/core/journals/journal-of-glaciology/firstview",
+        "https://www.cambridge.org/core/journals/annals-of-glaciology/firstview",
+    ]
+
     # run email alert for Journal of Glaciology and Annals of Glaciology
     # using sender acocunt
-    sender.check_new_FirstViews(
-        "https://www.cambridge.org/core/journals/journal-of-glaciology/firstview"
-    )
-    sender.check_new_FirstViews(
-        "https://www.cambridge.org/core/journals/annals-of-glaciology/firstview"
-    )
+    asyncio.run(main(sender, urls))